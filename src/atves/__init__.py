@@ -1,4 +1,5 @@
 """ atves module """
-from . import atves_database, atves_schema, axsis, axsis_types, conduent, creds, financial
+from . import address, atves_database, atves_schema, axsis, axsis_types, conduent, creds, financial, upsert
 
-__all__ = ['atves_database', 'atves_schema', 'axsis', 'axsis_types', 'conduent', 'creds', 'financial']
+__all__ = ['address', 'atves_database', 'atves_schema', 'axsis', 'axsis_types', 'conduent', 'creds', 'financial',
+           'upsert']
@@ -0,0 +1,33 @@
+"""Cleans up the street addresses that the camera vendors report, so the same location is geocoded the same way"""
+import re
+from functools import lru_cache
+
+# Used by standardize_address to clean up the street address in a single pass. Each match of _ADDRESS_RE is replaced
+# with its value in _ADDRESS_REPLACEMENTS
+_ADDRESS_REPLACEMENTS = {' BLK': '', ' BLOCK': '', 'JONES FALLS': 'I-83', 'JONES FALLS EXPWY': 'I-83',
+                         'JONES FALLS EXPRESSWAY': 'I-83', 'BLKLOCH': 'LOCH', ' HW': ' HWY', ' SB': '', ' NB': '',
+                         ' WB': '', ' EB': ''}
+_ADDRESS_RE = re.compile(r' (?:BLK|BLOCK)(?= )|JONES FALLS(?: EXPWY| EXPRESSWAY)?|BLKLOCH| HW\b| [NSEW]B\b')
+
+# Used by standardize_address to spell out the direction after the house number
+_DIRECTIONS = {'N': 'NORTH', 'N.': 'NORTH', 'S': 'SOUTH', 'S.': 'SOUTH', 'E': 'EAST', 'E.': 'EAST', 'W': 'WEST',
+               'W.': 'WEST'}
+
+
+@lru_cache(maxsize=4096)
+def standardize_address(street_address: str) -> str:
+    """
+    The original dataset has addresses formatted in various ways. This attempts to standardize them a bit. The same
+    camera addresses come up on every build, so the results are cached
+    """
+    # IE '4000 BLK PULASKI HW WB' -> '4000 PULASKI HWY'
+    street_address = ' '.join(street_address.upper().split())
+    street_address = _ADDRESS_RE.sub(lambda match: _ADDRESS_REPLACEMENTS[match.group(0)], street_address)
+
+    # IE '100 E. BALTIMORE ST' -> '100 EAST BALTIMORE ST'. The house number is optional, but must be all digits
+    house_number, _, street = street_address.partition(' ')
+    direction, found, street_name = street.partition(' ')
+    if found and (direction_name := _DIRECTIONS.get(direction)) and (not house_number or house_number.isdecimal()):
+        street_address = f'{house_number} {direction_name} {street_name}'
+
+    return street_address
@@ -1,42 +1,102 @@
 """Pulls data through the Conduent and Axsis libraries, and inserts it into the database"""
 import argparse
-import inspect
-import math
+import atexit
 import os
 import re
 import sys
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime, timedelta
+from functools import lru_cache, partial
 from json.decoder import JSONDecodeError
+from pathlib import Path
 from sqlite3 import Connection as SQLite3Connection
-from typing import Optional, Tuple
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
-from arcgis.geocoding import geocode  # type: ignore
-from arcgis.gis import GIS  # type: ignore
+import pandas as pd  # type: ignore
 from databasebaseclass.base import DatabaseBaseClass
 from loguru import logger
-from sqlalchemy import create_engine, event  # type: ignore
-from sqlalchemy.engine import Engine  # type: ignore
+from sqlalchemy import create_engine, event, func  # type: ignore
+from sqlalchemy.engine import Engine, make_url  # type: ignore
 from sqlalchemy.orm import Session  # type: ignore
+from sqlalchemy.types import DateTime  # type: ignore
 from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
 
+from atves.address import standardize_address
 from atves.constants import ALLCAMS, REDLIGHT, OVERHEIGHT, SPEED
-from atves.atves_schema import AtvesAmberTimeRejects, AtvesCamLocations, AtvesFinancial, AtvesRejectReason, \
-    AtvesTrafficCounts, AtvesViolations, AtvesViolationCategories, Base
+from atves.atves_schema import AtvesAmberTimeRejects, AtvesCamLocations, AtvesFinancial, AtvesGeocodeCache, \
+    AtvesRejectReason, AtvesTrafficCounts, AtvesViolations, AtvesViolationCategories, Base
 from atves.axsis import Axsis
 from atves.conduent import Conduent
+from atves.conduent_types import CameraType
 from atves.creds import AXSIS_USERNAME, AXSIS_PASSWORD, CONDUENT_USERNAME, CONDUENT_PASSWORD, REPORT_USERNAME, \
     REPORT_PASSWORD
 from atves.financial import CobReports
+from atves.upsert import UPSERT_DIALECTS, bulk_upsert, iter_records, set_mssql_nocount
 
-GIS()
+# Directory for the log files written by setup_logging, relative to the working directory
+_LOG_DIR = Path('logs')
+# Removing the handlers at exit drains the queue of the file handler from setup_logging and flushes its buffer. This is
+# registered once here, instead of on every call to setup_logging
+atexit.register(logger.remove)
+
+# The location id on the front of the 'Locations' column of the Conduent client summary by location report, IE
+# '1234 - 100 E. BALTIMORE ST'
+_LOCATION_ID_RE = re.compile(r'^(\d+)')
+
+_SQLITE_SYNC_MODES = ('FULL', 'NORMAL', 'OFF')
+# How long a SQLite write waits for another thread's write transaction to finish
+_SQLITE_BUSY_TIMEOUT_MS = 300000
+
+# Standardized addresses that AtvesDatabase.get_lat_long does not send to the geocoder, because they are placeholders
+# that never return a location
+_NOT_GEOCODABLE = {'', 'ALL LOCATIONS', 'UNKNOWN'}
+# Addresses per query when loading the geocode cache; Sql Server allows 2100 parameters per statement
+_GEOCODE_CACHE_BATCH_SIZE = 500
+
+# Used by AtvesDatabase._parse_effective_date to read the month of Conduent's camera effective dates
+_MONTHS = {'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6, 'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10,
+           'Nov': 11, 'Dec': 12}
+
+
+@lru_cache(maxsize=None)
+def _get_geocode() -> Callable:
+    """
+    Imports the ArcGIS geocoder and connects to ArcGIS Online the first time it is needed
+    :return: arcgis.geocoding.geocode, with the geocoder argument already set
+    """
+    from arcgis.geocoding import geocode, get_geocoders  # type: ignore  # pylint:disable=import-outside-toplevel
+    from arcgis.gis import GIS  # type: ignore  # pylint:disable=import-outside-toplevel
+
+    return partial(geocode, geocoder=get_geocoders(GIS())[0])
+
+
+def _get_sqlite_sync() -> str:
+    """
+    Reads the SQLite synchronous setting from the ATVES_SQLITE_SYNC environment variable
+    :return: One of _SQLITE_SYNC_MODES; NORMAL if the variable is not set
+    """
+    synchronous = os.environ.get('ATVES_SQLITE_SYNC', 'NORMAL').upper()
+    if synchronous not in _SQLITE_SYNC_MODES:
+        raise ValueError(f'ATVES_SQLITE_SYNC should be one of {_SQLITE_SYNC_MODES}, not {synchronous}')
+    return synchronous
 
 
 @event.listens_for(Engine, 'connect')
 def _set_sqlite_pragma(dbapi_connection, connection_record):  # pylint:disable=unused-argument
+    """
+    Turns on foreign keys and write ahead logging for SQLite, with the synchronous setting from ATVES_SQLITE_SYNC
+    """
     if isinstance(dbapi_connection, SQLite3Connection):
         cursor = dbapi_connection.cursor()
         cursor.execute('PRAGMA foreign_keys=ON;')
+        cursor.execute('PRAGMA journal_mode=WAL;')
+        cursor.execute(f'PRAGMA synchronous={_get_sqlite_sync()};')
+        cursor.execute('PRAGMA temp_store=MEMORY;')
+        # The Axsis, Conduent and financial reports are written from separate threads, so wait for each other's write
+        # transactions instead of failing with 'database is locked' after sqlite3's default of 5 seconds
+        cursor.execute(f'PRAGMA busy_timeout={_SQLITE_BUSY_TIMEOUT_MS};')
+        cursor.execute('PRAGMA cache_size=-65536;')  # 64 MiB
         cursor.close()
 
 
@@ -55,6 +115,29 @@ VIOLATION_TYPES = {
     5: 'Violation Issued'
 }
 
+# The VIOLATION_TYPES key for each value of the iOrderBy column of the Conduent client summary by location report
+CONDUENT_VIOLATION_CATS = {
+    '1- In Process': 1,
+    '2- Conduent/City Non Violations': 2,
+    '3- Conduent/City Rejects(Controllable)': 3,
+    '4- Conduent/City Rejects(Uncontrollable)': 4,
+    '5- Violations Mailed': 5
+}
+
+# The VIOLATION_TYPES key for each count column of the Axsis location summary by lane report
+AXSIS_VIOLATION_CATS = {
+    'Events still in WF': 1,
+    'Non Events': 2,
+    'PD Non Events': 2,
+    'Controllable': 3,
+    'PD Controllable': 3,
+    'Uncontrollable': 4,
+    'PD Uncontrollable': 4,
+    'Citations Issued': 5,
+    'Nov Issued': 5,
+    'Warning Issued': 5
+}
+
 
 class AtvesDatabase(DatabaseBaseClass):
     """ Helper class for the Conduent and Axsis classes that inserts data into the relevant databases"""
@@ -62,7 +145,7 @@ class AtvesDatabase(DatabaseBaseClass):
     def __init__(self, conn_str: str, axsis_user: Optional[str] = AXSIS_USERNAME,  # pylint:disable=too-many-arguments
                  axsis_pass: Optional[str] = AXSIS_PASSWORD, conduent_user: Optional[str] = CONDUENT_USERNAME,
                  conduent_pass: Optional[str] = CONDUENT_PASSWORD, report_user: Optional[str] = REPORT_USERNAME,
-                 report_pass: Optional[str] = REPORT_PASSWORD):
+                 report_pass: Optional[str] = REPORT_PASSWORD, echo: Optional[bool] = None):
         """
         :param conn_str: sqlalchemy connection string (IE sqlite:///crash.db or
         Driver={SQL Server};Server=balt-sql311-prd;Database=DOT_DATA;Trusted_Connection=yes;)
@@ -72,9 +155,27 @@ class AtvesDatabase(DatabaseBaseClass):
         :param conduent_pass: password for https://cw3.cite-web.com/loginhub/Main.aspx
         :param report_user: username for https://cobrpt02.rsm.cloud/ReportServer
         :param report_pass: password for https://cobrpt02.rsm.cloud/ReportServer
+        :param echo: Log every SQL statement and its parameters. This is expensive on large ingests, so it is off unless
+        this is true or (when this is None) the ATVES_SQL_ECHO environment variable is set
         """
         logger.info('Creating db with connection string: {}', conn_str)
-        self.engine = create_engine(conn_str, echo=True, future=True)
+        if echo is None:
+            echo = bool(os.environ.get('ATVES_SQL_ECHO'))
+        engine_args: Dict[str, Any] = {}
+        url = make_url(conn_str)
+        if url.get_backend_name() == 'sqlite':
+            # Checked here so a bad value fails now, instead of in the connect event of the first query
+            _get_sqlite_sync()
+        else:
+            # Reports run from up to three threads at once (financials, Axsis and Conduent) over a long ingest, so keep
+            # their connections open and replace any that the server dropped, instead of failing mid report
+            engine_args.update(pool_size=5, max_overflow=5, pool_pre_ping=True, pool_recycle=1800)
+        if url.get_backend_name() == 'mssql' and url.get_driver_name() == 'pyodbc':
+            # Without this, pyodbc sends executemany (IE each batch in bulk_upsert) as one round trip per row
+            engine_args['fast_executemany'] = True
+        self.engine = create_engine(conn_str, echo=echo, future=True, **engine_args)
+        if url.get_backend_name() == 'mssql':
+            event.listen(self.engine, 'connect', set_mssql_nocount)
 
         with self.engine.begin() as connection:
             Base.metadata.create_all(connection)
@@ -103,6 +204,9 @@ class AtvesDatabase(DatabaseBaseClass):
         self.location_db_built = False
         self.violation_lookup_db_built = False
 
+        # Standardized address to (lat, long), in front of the geocode cache table
+        self._lat_long_cache: Dict[str, Tuple[Optional[float], Optional[float]]] = {}
+
     def build_location_db(self, force: bool = False) -> None:
         """
         Builds the location database with each camera and their lat/long
@@ -118,15 +222,18 @@ class AtvesDatabase(DatabaseBaseClass):
         self._build_db_speed_cameras()
 
         with Session(bind=self.engine, future=True) as session:
-            # Look for missing location ids
-            location_codes = session.query(AtvesViolations.location_code).all()
-            location_codes += session.query(AtvesTrafficCounts.location_code).all()
-
-            existing_location_codes = session.query(AtvesCamLocations.location_code).all()
-
-            diff = set(location_codes) - set(existing_location_codes)
+            # Look for missing location ids. The database does the diff, so only the missing codes (usually none) are
+            # returned instead of every row of the data tables
+            existing_location_codes = session.query(AtvesCamLocations.location_code)
+            diff = session.query(AtvesViolations.location_code) \
+                .filter(AtvesViolations.location_code.not_in(existing_location_codes)) \
+                .union(session.query(AtvesTrafficCounts.location_code)
+                       .filter(AtvesTrafficCounts.location_code.not_in(existing_location_codes))) \
+                .union(session.query(AtvesAmberTimeRejects.location_code)
+                       .filter(AtvesAmberTimeRejects.location_code.not_in(existing_location_codes))) \
+                .all()
             if diff:
-                raise AssertionError('Missing location codes: {diff}')
+                raise AssertionError(f'Missing location codes: {[location_code for location_code, in diff]}')
 
         self.location_db_built = True
 
@@ -134,8 +241,8 @@ class AtvesDatabase(DatabaseBaseClass):
         """Builds a violation description lookup table"""
         if self.violation_lookup_db_built:
             return
-        for vio_key, vio_desc in VIOLATION_TYPES.items():
-            self._insert_or_update(AtvesViolationCategories(violation_cat=vio_key, description=vio_desc))
+        self._bulk_upsert(AtvesViolationCategories, [{'violation_cat': vio_key, 'description': vio_desc}
+                                                     for vio_key, vio_desc in VIOLATION_TYPES.items()])
         self.violation_lookup_db_built = True
 
     def _build_db_conduent_red_light(self) -> None:
@@ -154,30 +261,27 @@ class AtvesDatabase(DatabaseBaseClass):
         :return: None
         """
         if not self.conduent_interface:
-            logger.warning('Unable to run {}. No Conduent session is setup.', inspect.stack()[0][3])
+            logger.warning('Unable to run _build_db_conduent. No Conduent session is setup.')
             return
 
-        failures = 0
-        loc_id = 0
-
-        # we use the 'failures' because we don't know the range of valid location ids
-        while failures <= 50:
-            loc_id += 1
-            ret = self.conduent_interface.get_location_by_id(loc_id, cam_type)
-            if ret['site_code'] is None:
-                failures += 1
-                continue
-
+        cam_dates = self._get_all_cam_start_end()
+        cam_locations: List[AtvesCamLocations] = []
+        found_cams = self._find_conduent_cams(cam_type)
+        self._prefetch_lat_long(ret['location'] for ret in found_cams if ret['location'])
+        for ret in found_cams:
             try:
                 lat, lng = self.get_lat_long(ret['location'])
-                cam_start_date, cam_end_date = self._get_cam_start_end(str(ret['site_code']))
+                cam_start_date, cam_end_date = cam_dates.get(str(ret['site_code']), (None, None))
                 if ret['effective_date'] is not None:
-                    cam_start_date = datetime.strptime(ret['effective_date'], '%b %d, %Y').date()
+                    try:
+                        cam_start_date = self._parse_effective_date(ret['effective_date'])
+                    except ValueError as err:
+                        logger.warning('Using the first record as the start date of {}: {}', ret['site_code'], err)
 
                 days_active = (cam_end_date - cam_start_date).days if cam_start_date and cam_end_date else None
 
                 speed_limit = int(ret['speed_limit']) if ret['speed_limit'] is not None else 0
-                self._insert_or_update(AtvesCamLocations(
+                cam_locations.append(AtvesCamLocations(
                     location_code=str(ret['site_code']),
                     locationdescription=str(ret['location']),
                     lat=lat,
@@ -191,6 +295,31 @@ class AtvesDatabase(DatabaseBaseClass):
             except RuntimeError as err:
                 logger.warning('Geocoder error: {}', err)
 
+        self._write_cam_locations(self._get_changed_cam_locations(cam_locations))
+
+    def _find_conduent_cams(self, cam_type: int) -> List[CameraType]:
+        """
+        Looks up Conduent location ids in order until more than 50 of them are not found
+        :param cam_type: Type of camera data to pull (use the constants conduent.REDLIGHT or conduent.OVERHEIGHT
+        :return: The cameras that were found, from `Conduent.get_location_by_id`
+        """
+        found_cams: List[CameraType] = []
+        if not self.conduent_interface:
+            return found_cams
+
+        # we use the 'failures' because we don't know the range of valid location ids. The session only needs to be set
+        # up for the camera type before the first lookup, which saves two requests on every other id
+        failures = 0
+        loc_id = 0
+        while failures <= 50:
+            loc_id += 1
+            ret = self.conduent_interface.get_location_by_id(loc_id, cam_type, setup_request=loc_id == 1)
+            if ret['site_code'] is None:
+                failures += 1
+                continue
+            found_cams.append(ret)
+        return found_cams
+
     def _build_db_speed_cameras(self) -> bool:
         """Builds the camera location database for speed cameras"""
         if not self.axsis_interface:
@@ -208,6 +337,9 @@ class AtvesDatabase(DatabaseBaseClass):
                        if param['ParmTitle'] == 'Violation Locations' and param['ParmList'] is not None
                        for param_elem in param['ParmList']]
 
+        cam_dates = self._get_all_cam_start_end()
+        cam_locations: List[AtvesCamLocations] = []
+        self._prefetch_lat_long(location for location_code, location in active_cams if location_code and location)
         for location_code, location in active_cams:
             lat: Optional[float] = None
             lng: Optional[float] = None
@@ -215,7 +347,7 @@ class AtvesDatabase(DatabaseBaseClass):
             if not location_code:
                 continue
 
-            cam_start_date, cam_end_date = self._get_cam_start_end(location_code)
+            cam_start_date, cam_end_date = cam_dates.get(location_code, (None, None))
 
             # if the location was specified, then lets look it up
             if location:
@@ -225,66 +357,118 @@ class AtvesDatabase(DatabaseBaseClass):
 
             days_active = (cam_end_date - cam_start_date).days if cam_start_date and cam_end_date else None
 
-            self._insert_or_update(AtvesCamLocations(location_code=location_code,
-                                                     locationdescription=location,
-                                                     lat=lat,
-                                                     long=lng,
-                                                     cam_type='SC',
-                                                     effective_date=cam_start_date,
-                                                     last_record=cam_end_date,
-                                                     days_active=days_active,
-                                                     speed_limit=None,
-                                                     status=None))
-
+            cam_locations.append(AtvesCamLocations(location_code=location_code,
+                                                   locationdescription=location,
+                                                   lat=lat,
+                                                   long=lng,
+                                                   cam_type='SC',
+                                                   effective_date=cam_start_date,
+                                                   last_record=cam_end_date,
+                                                   days_active=days_active,
+                                                   speed_limit=None,
+                                                   status=None))
+
+        self._write_cam_locations(self._get_changed_cam_locations(cam_locations))
         return True
 
-    def _get_cam_start_end(self, location_code: str) -> Tuple[Optional[date], Optional[date]]:
+    def _get_existing_cam_locations(self) -> Dict[str, Tuple]:
         """
-        Gets the camera activity dates based on traffic data or violation data
-        :param location_code: Camera location code that matches the camera location table
-        :return: start and end date for the camera; active cameras are still given an end date
+        Gets the camera locations that are already in the database, for `_get_changed_cam_locations`
+        :return: dictionary of location code to the values from `_get_cam_location_values`
         """
-        cam_start_date: Optional[date] = None
-        cam_end_date: Optional[date] = None
-
         with Session(bind=self.engine, future=True) as session:
-            # First, lets get a date when this camera existed... lets look for traffic counts first
-            traffic_counts = session.query(AtvesTrafficCounts.date). \
-                filter(AtvesTrafficCounts.location_code == location_code)
-
-            if traffic_counts.order_by(AtvesTrafficCounts.date).first():
-                cam_start_date = traffic_counts.order_by(AtvesTrafficCounts.date).first()[0]
-
-            if traffic_counts.order_by(AtvesTrafficCounts.date.desc()).first():
-                cam_end_date = traffic_counts.order_by(AtvesTrafficCounts.date.desc()).first()[0]
+            return {cam_location.location_code: self._get_cam_location_values(cam_location)
+                    for cam_location in session.query(AtvesCamLocations)}
 
-            # if there were no traffic counts, lets look for issued violations
-            if not cam_start_date:
-                ret = session.query(AtvesViolations.date) \
-                    .filter(AtvesViolations.location_code == location_code)
-
-                if ret.order_by(AtvesViolations.date).first():
-                    cam_start_date = ret.first()[0]
+    def _get_changed_cam_locations(self, cam_locations: List[AtvesCamLocations]) -> List[AtvesCamLocations]:
+        """
+        Compares camera locations found by a location builder to the ones already in the database, so the location
+        builders can skip writing cameras that have not changed
+        :param cam_locations: Camera locations, not yet inserted
+        :return: The camera locations that are new or differ from the database
+        """
+        existing_cams = self._get_existing_cam_locations()
+        return [cam_location for cam_location in cam_locations
+                if existing_cams.get(cam_location.location_code) != self._get_cam_location_values(cam_location)]
 
-                if ret.order_by(AtvesViolations.date.desc()).first():
-                    cam_end_date = ret.order_by(AtvesViolations.date.desc()).first()[0]
+    @staticmethod
+    def _parse_effective_date(effective_date: str) -> date:
+        """
+        Parses the effective date of a Conduent camera, IE 'Jan 05, 2021'. The month abbreviation can be in any case
+        :param effective_date: Effective date from `Conduent.get_location_by_id`
+        :return: The effective date; raises ValueError if it is not in that format
+        """
+        try:
+            month, day, year = effective_date.replace(',', '').split()
+            return date(int(year), _MONTHS[month.title()], int(day))
+        except (KeyError, ValueError) as err:
+            raise ValueError(f'Unable to parse effective date {effective_date!r}') from err
 
-        return cam_start_date, cam_end_date
+    def _write_cam_locations(self, cam_locations: List[AtvesCamLocations]) -> None:
+        """
+        Writes the new and changed camera locations found by a location builder, in one transaction instead of one per
+        camera
+        :param cam_locations: Camera locations to insert or update
+        """
+        columns = [col.name for col in AtvesCamLocations.__table__.columns]
+        self._bulk_upsert(AtvesCamLocations, [{col: getattr(cam_location, col) for col in columns}
+                                              for cam_location in cam_locations])
 
-    def process_conduent_data_amber_time(self, start_date: date, end_date: date, build_loc_db: bool = True,
+    @staticmethod
+    def _get_cam_location_values(cam_location: AtvesCamLocations) -> Tuple:
+        """
+        The values of a camera location, in a form that can be compared between new objects and database rows
+        :param cam_location: Camera location, either from the database or not yet inserted
+        """
+        # lat/long are stored with 4 decimal places, so round new values the same way before comparing them
+        return (cam_location.locationdescription,
+                None if cam_location.lat is None else round(float(cam_location.lat), 4),
+                None if cam_location.long is None else round(float(cam_location.long), 4),
+                cam_location.cam_type,
+                cam_location.effective_date,
+                cam_location.last_record,
+                cam_location.days_active,
+                cam_location.speed_limit,
+                cam_location.status)
+
+    def _get_all_cam_start_end(self) -> Dict[str, Tuple[Optional[date], Optional[date]]]:
+        """
+        Gets the camera activity dates for every camera at once, based on traffic data or, if a camera has none,
+        violation data
+        :return: dictionary of location code to the start and end date for the camera
+        """
+        with Session(bind=self.engine, future=True) as session:
+            # violations are only used when there are no traffic counts, so the traffic counts overwrite them
+            ret: Dict[str, Tuple[Optional[date], Optional[date]]] = {
+                location_code: (start_date, end_date)
+                for location_code, start_date, end_date in session.query(AtvesViolations.location_code,
+                                                                         func.min(AtvesViolations.date),
+                                                                         func.max(AtvesViolations.date))
+                .group_by(AtvesViolations.location_code)}
+
+            ret.update({
+                location_code: (start_date, end_date)
+                for location_code, start_date, end_date in session.query(AtvesTrafficCounts.location_code,
+                                                                         func.min(AtvesTrafficCounts.date),
+                                                                         func.max(AtvesTrafficCounts.date))
+                .group_by(AtvesTrafficCounts.location_code)})
+
+        return ret
+
+    def process_conduent_data_amber_time(self, start_date: date, end_date: date, build_loc_db: bool = False,
                                          force: bool = False) -> None:
         """
         Pulls the amber time report
 
         :param start_date: Start date of the report to pull
         :param end_date: End date of the report to pull
-        :param build_loc_db: If true, then it will rebuild the location db even if it was already built this session
+        :param build_loc_db: If true, then it will rebuild the location db even if it was already built this session.
+        By default, it is only built if it has not been built yet this session
         :param force: Pulls data on the whole range of dates; by default it skips dates that already have data in the
         database
         :return: None
         """
-        logger.info('Processing conduent amber time report from {} to {}', start_date.strftime('%m/%d/%y'),
-                    end_date.strftime('%m/%d/%y'))
+        logger.info('Processing conduent amber time report from {:%m/%d/%y} to {:%m/%d/%y}', start_date, end_date)
 
         if not self.conduent_interface:
             logger.warning('Unable to run process_conduent_data_amber_time. It requires a Conduent session, which is '
@@ -293,19 +477,19 @@ class AtvesDatabase(DatabaseBaseClass):
 
         self.build_location_db(build_loc_db)
         dates = self.get_dates_to_process(start_date, end_date, AtvesAmberTimeRejects.violation_date, force)
-        for working_date in dates:
-            if (data := self.conduent_interface.get_amber_time_rejects_report(working_date, working_date)).empty:
+        for data in self._fetch_ahead(self.conduent_interface.get_amber_time_rejects_report,
+                                      self._get_date_ranges(dates)):
+            if data.empty:
                 # no data
                 continue
 
-            for _, row in data.iterrows():  # pylint:disable=no-member
-                self._insert_or_update(AtvesAmberTimeRejects(
-                    location_code=int(row['iLocationCode']),
-                    deployment_no=int(row['Deployment Number']),
-                    violation_date=row['VioDate'],
-                    amber_time=float(row['Amber Time']),
-                    amber_reject_code=str(row['Amber Reject Code']),
-                    event_number=int(row['Event Number'])))
+            self._bulk_upsert(AtvesAmberTimeRejects, iter_records(pd.DataFrame({
+                'location_code': data['iLocationCode'].astype(int).astype(str),
+                'deployment_no': data['Deployment Number'].astype(int),
+                'violation_date': data['VioDate'],
+                'amber_time': data['Amber Time'].astype(float),
+                'amber_reject_code': data['Amber Reject Code'].astype(str),
+                'event_number': data['Event Number'].astype(int)})))
 
     def process_traffic_count_data(self, start_date: date, end_date: date, force: bool = False) -> None:
         """
@@ -316,51 +500,50 @@ class AtvesDatabase(DatabaseBaseClass):
         database
         :return:
         """
-        logger.info('Processing traffic count data from {} to {}', start_date.strftime('%m/%d/%y'),
-                    end_date.strftime('%m/%d/%y'))
+        logger.info('Processing traffic count data from {:%m/%d/%y} to {:%m/%d/%y}', start_date, end_date)
 
         self.build_location_db()
-        self._process_traffic_count_data_axsis(start_date, end_date, force)
-        self._process_traffic_count_data_conduent(start_date, end_date, force)
+        dates = self.get_dates_to_process(start_date, end_date, AtvesTrafficCounts.date, force)
+        self._process_axsis_and_conduent(self._process_traffic_count_data_axsis,
+                                         self._process_traffic_count_data_conduent,
+                                         self._get_date_ranges(dates))
 
-    def _process_traffic_count_data_axsis(self, start_date: date, end_date: date, force: bool = False) -> None:
+    def _process_traffic_count_data_axsis(self, date_ranges: List[Tuple[date, date]]) -> None:
         if not self.axsis_interface:
             logger.warning('Unable to run _process_traffic_count_data_axsis. It requires a Axsis session, which is not '
                            'setup.')
             return
 
-        dates = self.get_dates_to_process(start_date, end_date, AtvesTrafficCounts.date, force)
-        for working_date in dates:
-            if (data := self.axsis_interface.get_traffic_counts(working_date, working_date)).empty:
+        for data in self._fetch_ahead(self.axsis_interface.get_traffic_counts, date_ranges):
+            if data.empty:
                 # no data
                 continue
 
-            data = data.to_dict('index')
-            columns = data[0].keys() - ['Location code', 'Description', 'First Traf Evt', 'Last Traf Evt']
-
-            for row in data.values():
-                for event_date in columns:
-                    if not math.isnan(row[event_date]):
-                        self._insert_or_update(AtvesTrafficCounts(location_code=str(row['Location code']).strip(),
-                                                                  date=datetime.strptime(event_date, '%m/%d/%Y').date(),
-                                                                  count=int(row[event_date])))
-
-    def _process_traffic_count_data_conduent(self, start_date: date, end_date: date, force: bool = False) -> None:
+            # The report has a column per day; reshape it to a row per camera per day, without the empty days
+            counts = data.melt(id_vars=['Location code'],
+                               value_vars=[col for col in data.columns if col not in
+                                           ['Location code', 'Description', 'First Traf Evt', 'Last Traf Evt']],
+                               var_name='date', value_name='count').dropna(subset=['count'])
+            self._bulk_upsert(AtvesTrafficCounts, iter_records(pd.DataFrame({
+                'location_code': counts['Location code'].astype(str).str.strip(),
+                'date': pd.to_datetime(counts['date'], format='%m/%d/%Y').dt.date,
+                'count': counts['count'].astype(int)})))
+
+    def _process_traffic_count_data_conduent(self, date_ranges: List[Tuple[date, date]]) -> None:
         if not self.conduent_interface:
             logger.warning('Unable to run _process_traffic_count_data_conduent. It requires a Conduent '
                            'session, which is not setup.')
             return
 
-        dates = self.get_dates_to_process(start_date, end_date, AtvesTrafficCounts.date, force)
-        for working_date in dates:
-            if (data := self.conduent_interface.get_traffic_counts_by_location(working_date, working_date)).empty:
+        for data in self._fetch_ahead(self.conduent_interface.get_traffic_counts_by_location, date_ranges):
+            if data.empty:
                 # no data
                 continue
 
-            for _, row in data.iterrows():  # pylint:disable=no-member
-                self._insert_or_update(AtvesTrafficCounts(location_code=str(row['iLocationCode']).strip(),
-                                                          date=row['Ddate'],
-                                                          count=int(row['VehPass'])))
+            self._bulk_upsert(AtvesTrafficCounts, iter_records(pd.DataFrame({
+                'location_code': data['iLocationCode'].astype(str).str.strip(),
+                'date': data['Ddate'],
+                'count': data['VehPass'].astype(int)})))
 
     def process_violations(self, start_date: date, end_date: date, force: bool = False) -> None:
         """
@@ -371,98 +554,101 @@ class AtvesDatabase(DatabaseBaseClass):
         database
         :return:
         """
-        logger.info('Processing violation data from {} to {}', start_date.strftime('%m/%d/%y'),
-                    end_date.strftime('%m/%d/%y'))
+        logger.info('Processing violation data from {:%m/%d/%y} to {:%m/%d/%y}', start_date, end_date)
 
         self.build_location_db()
         self.build_violation_lookup_db()
 
         dates = self.get_dates_to_process(start_date, end_date, AtvesViolations.date, force)
-        for working_date in dates:
-            self._process_violations_axsis(working_date, working_date)
-            self._process_violations_conduent(working_date, working_date)
+        self._process_axsis_and_conduent(self._process_violations_axsis, self._process_violations_conduent,
+                                         self._get_date_ranges(dates))
 
-    def _process_violations_axsis(self, start_date: date, end_date: date) -> None:
+    @staticmethod
+    def _process_axsis_and_conduent(axsis_func: Callable[[List[Tuple[date, date]]], None],
+                                    conduent_func: Callable[[List[Tuple[date, date]]], None],
+                                    date_ranges: List[Tuple[date, date]]) -> None:
+        """
+        Runs the Axsis and the Conduent half of a report at the same time, each over every date range
+        :param axsis_func: Method that processes the Axsis report for a list of date ranges
+        :param conduent_func: Method that processes the Conduent report for a list of date ranges
+        :param date_ranges: List of (start date, end date) to process, from `_get_date_ranges`
+        """
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            futures = [pool.submit(func, date_ranges) for func in (axsis_func, conduent_func)]
+        for future in futures:
+            # Reraises any exception from the worker
+            future.result()
+
+    @staticmethod
+    def _fetch_ahead(fetch: Callable[[date, date], Any], date_ranges: List[Tuple[date, date]]) -> Iterator[Any]:
+        """
+        Yields the report for each date range, in order, while the report for the next range is downloaded
+        :param fetch: Method that pulls a report for a start and end date, IE Axsis.get_traffic_counts
+        :param date_ranges: List of (start date, end date) to pull, from `_get_date_ranges`
+        """
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            pending = None
+            for range_start, range_end in date_ranges:
+                future = pool.submit(fetch, range_start, range_end)
+                if pending is not None:
+                    yield pending.result()
+                pending = future
+            if pending is not None:
+                yield pending.result()
+
+    def _process_violations_axsis(self, date_ranges: List[Tuple[date, date]]) -> None:
         if not self.axsis_interface:
             logger.warning('Unable to run _process_violations_axsis. It requires a Axsis session, which is not '
                            'setup.')
             return
 
-        if (data := self.axsis_interface.get_location_summary_by_lane(start_date, end_date)).empty:
-            # no data
-            return
+        for data in self._fetch_ahead(self.axsis_interface.get_location_summary_by_lane, date_ranges):
+            if data.empty:
+                # no data
+                continue
 
-        for _, row in data.iterrows():
-            for code, desc in ((1, 'Events still in WF'),
-                               (2, 'Non Events'),
-                               (2, 'PD Non Events'),
-                               (3, 'Controllable'),
-                               (3, 'PD Controllable'),
-                               (4, 'Uncontrollable'),
-                               (4, 'PD Uncontrollable'),
-                               (5, 'Citations Issued'),
-                               (5, 'Nov Issued'),
-                               (5, 'Warning Issued')):
-                self._insert_or_update(AtvesViolations(date=row['Date'],
-                                                       location_code=str(row['Location Code']),
-                                                       count=row[desc],
-                                                       violation_cat=code,
-                                                       details=desc))
-
-    def _process_violations_conduent(self, start_date: date, end_date: date, cam_type: int = ALLCAMS) -> None:
-        """
-
-        :param cam_type: Either conduent.REDLIGHT or conduent.OVERHEIGHT
-        :param start_date: Start date of the report to pull
-        :param end_date: End date of the report to pull
-        :return:
+            # The report has a column per violation type; reshape it to a row per camera per day per violation type
+            violations = data.melt(id_vars=['Date', 'Location Code'], value_vars=list(AXSIS_VIOLATION_CATS.keys()),
+                                   var_name='details', value_name='count').dropna(subset=['count'])
+            self._bulk_upsert(AtvesViolations, iter_records(pd.DataFrame({
+                'date': violations['Date'],
+                'location_code': violations['Location Code'].astype(str),
+                'count': violations['count'],
+                'violation_cat': violations['details'].map(AXSIS_VIOLATION_CATS),
+                'details': violations['details']})))
+
+    def _process_violations_conduent(self, date_ranges: List[Tuple[date, date]], cam_type: int = ALLCAMS) -> None:
         """
-        def _get_int(value) -> int:
-            """Gets int on the front of the string"""
-            pattern = re.compile(r'(\d*)')
-            ret = 0
-            if value != 'All Locations':
-                match = pattern.match(value)
-                if match is None or match.lastindex is None or match.lastindex < 1:
-                    logger.error('Unable to parse location {}', value)
-                    ret = 0
-                else:
-                    ret = int(match.group(1))
-            return ret
-
-        violation_lookup = {
-            '1- In Process': 1,
-            '2- Conduent/City Non Violations': 2,
-            '3- Conduent/City Rejects(Controllable)': 3,
-            '4- Conduent/City Rejects(Uncontrollable)': 4,
-            '5- Violations Mailed': 5
-        }
 
+        :param date_ranges: List of (start date, end date) of the reports to pull
+        :param cam_type: Either conduent.REDLIGHT, conduent.OVERHEIGHT or conduent.ALLCAMS
+        :return:
+        """
         if not self.conduent_interface:
             logger.warning('Unable to run _process_violations_conduent. It requires a Conduent session, which is not '
                            'setup.')
             return
 
-        if cam_type == ALLCAMS:
-            self._process_violations_conduent(start_date, end_date, REDLIGHT)
-            self._process_violations_conduent(start_date, end_date, OVERHEIGHT)
-            return
-
-        logger.info('Processing conduent location data reports from {} to {}', start_date.strftime('%m/%d/%y'),
-                    end_date.strftime('%m/%d/%y'))
-
-        if (data := self.conduent_interface.get_client_summary_by_location(start_date, end_date)).empty:
-            # no data
-            return
-        for _, row in data.iterrows():
-            location_id = _get_int(row['Locations'])
-            if location_id == 0:
+        # The report for ALLCAMS is the red light and overheight reports together
+        for (range_start, range_end), data in zip(date_ranges, self._fetch_ahead(
+                partial(self.conduent_interface.get_client_summary_by_location, cam_type=cam_type), date_ranges)):
+            logger.info('Processing conduent location data reports from {:%m/%d/%y} to {:%m/%d/%y}', range_start,
+                        range_end)
+            if data is None or data.empty:
+                # no data
                 continue
-            self._insert_or_update(AtvesViolations(date=row['Date'],
-                                                   location_code=str(location_id),
-                                                   count=int(row['DetailCount']),
-                                                   violation_cat=violation_lookup[row['iOrderBy']],
-                                                   details=str(row['vcDescription'])))
+            # The report is the concatenation of one report per day, so the index is not unique
+            data = data.reset_index(drop=True)
+            data['location_id'] = pd.to_numeric(data['Locations'].str.extract(_LOCATION_ID_RE, expand=False))
+            for value in data.loc[data['location_id'].isna() & (data['Locations'] != 'All Locations'), 'Locations']:
+                logger.error('Unable to parse location {}', value)
+            data = data[data['location_id'] > 0]
+            self._bulk_upsert(AtvesViolations, iter_records(pd.DataFrame({
+                'date': data['Date'],
+                'location_code': data['location_id'].astype(int).astype(str),
+                'count': data['DetailCount'].astype(int),
+                'violation_cat': data['iOrderBy'].map(CONDUENT_VIOLATION_CATS),
+                'details': data['vcDescription'].astype(str)})))
 
     def process_financials(self, start_date: date, end_date: date, cam_type: int = ALLCAMS,
                            force: bool = False) -> None:
@@ -475,15 +661,15 @@ class AtvesDatabase(DatabaseBaseClass):
         database
         """
         dates = self.get_dates_to_process(start_date, end_date, AtvesFinancial.ledger_posting_date, force)
-        for working_date in dates:
+        for range_start, range_end in self._get_date_ranges(dates):
             if cam_type in [ALLCAMS, OVERHEIGHT]:
-                self._process_overheight_financials(working_date, working_date)
+                self._process_overheight_financials(range_start, range_end)
 
             if cam_type in [ALLCAMS, REDLIGHT]:
-                self._process_redlight_financials(working_date, working_date)
+                self._process_redlight_financials(range_start, range_end)
 
             if cam_type in [ALLCAMS, SPEED]:
-                self._process_speed_financials(working_date, working_date)
+                self._process_speed_financials(range_start, range_end)
 
     def _process_overheight_financials(self, start_date: date, end_date: date) -> None:
         """
@@ -533,25 +719,24 @@ class AtvesDatabase(DatabaseBaseClass):
         if (data := self.financial_interface.get_general_ledger_detail(start_date, end_date, account, '55')).empty:
             # no data
             return
-        for _, row in data.iterrows():  # pylint:disable=no-member
-            self._insert_or_update(AtvesFinancial(
-                journal_entry_no=row['JournalEntryNo'],
-                ledger_posting_date=row['LedgerPostingDate'],
-                account_no=row['AccountNo'],
-                legacy_account_no=row['LegacyAccountNo'],
-                amount=float(row['Amount']),
-                source_journal=row['SourceJournal'],
-                trx_reference=row['TrxReference'],
-                TrxDescription=row['TrxDescription'],
-                user_who_posted=row['UserWhoPosted'],
-                trx_no=row['TrxNo'],
-                vendorid_or_customerid=row['VendorIDOrCustomerID'],
-                vendor_or_customer_name=row['VendorOrCustomerName'],
-                document_no=row['DocumentNo'],
-                Trx_source=row['TrxSource'],
-                account_description=row['AccountDescription'],
-                account_type=row['AccountType'],
-                agency_or_category=row['AgencyOrCategory']))
+        self._bulk_upsert(AtvesFinancial, iter_records(pd.DataFrame({
+            'journal_entry_no': data['JournalEntryNo'],
+            'ledger_posting_date': data['LedgerPostingDate'],
+            'account_no': data['AccountNo'],
+            'legacy_account_no': data['LegacyAccountNo'],
+            'amount': data['Amount'].astype(float),
+            'source_journal': data['SourceJournal'],
+            'trx_reference': data['TrxReference'],
+            'TrxDescription': data['TrxDescription'],
+            'user_who_posted': data['UserWhoPosted'],
+            'trx_no': data['TrxNo'],
+            'vendorid_or_customerid': data['VendorIDOrCustomerID'],
+            'vendor_or_customer_name': data['VendorOrCustomerName'],
+            'document_no': data['DocumentNo'],
+            'Trx_source': data['TrxSource'],
+            'account_description': data['AccountDescription'],
+            'account_type': data['AccountType'],
+            'agency_or_category': data['AgencyOrCategory']})))
 
     def process_officer_actions(self, start_date: date, end_date: date, force: bool = False) -> None:
         """
@@ -566,60 +751,135 @@ class AtvesDatabase(DatabaseBaseClass):
             return
 
         dates = self.get_dates_to_process(start_date, end_date, AtvesRejectReason.date, force)
-        for working_date in dates:
-            if (data := self.axsis_interface.get_officer_actions(working_date, working_date))['1'].empty:
+        for data in self._fetch_ahead(self.axsis_interface.get_officer_actions, self._get_date_ranges(dates)):
+            if data['1'].empty:
                 # no data
                 continue
 
-            for _, row in data['1'].iterrows():
-                self._insert_or_update(AtvesRejectReason(
-                    date=row['Date'],
-                    reject_reason=row['Reject Reason Factors'],
-                    pd_review=row['PD Review'],
-                    supervisor_review=row['Supervisor Review'],
-                    total=row['Total Count']
-                ))
+            self._bulk_upsert(AtvesRejectReason, iter_records(pd.DataFrame({
+                'date': data['1']['Date'],
+                'reject_reason': data['1']['Reject Reason Factors'],
+                'pd_review': data['1']['PD Review'],
+                'supervisor_review': data['1']['Supervisor Review'],
+                'total': data['1']['Total Count']})))
+
+    def get_dates_to_process(self, start_date: date, end_date: date, column, force: bool = False) -> List[date]:
+        """
+        Gets the dates in the range that do not have data yet. This replaces the DatabaseBaseClass version, which loads
+        every value of the column in the table; this only asks the database for the distinct values in the range
+        :param start_date: First date (inclusive) to write to the database
+        :param end_date: Last date (inclusive) to write to the database
+        :param column: sqlalchemy date or datetime column to search for matching dates to skip
+        :param force: Regenerate the data for the date range. By default, it skips dates with existing data.
+        :return: List of dates to process, most recent first
+        """
+        expected_dates = {start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)}
+        if force:
+            return sorted(expected_dates, reverse=True)
+
+        range_start = start_date
+        range_end = end_date + timedelta(days=1)
+        if isinstance(column.type, DateTime):
+            range_start = datetime.combine(range_start, datetime.min.time())
+            range_end = datetime.combine(range_end, datetime.min.time())
+
+        with Session(bind=self.engine, future=True) as session:
+            existing_dates = {i.date() if isinstance(i, datetime) else i
+                              for i, in session.query(column).filter(column >= range_start,
+                                                                     column < range_end).distinct()}
+
+        return sorted(expected_dates - existing_dates, reverse=True)
+
+    def _bulk_upsert(self, model, rows: Iterable[Dict[str, Any]]) -> None:
+        """
+        Inserts rows, or updates them if the primary key already exists, with `atves.upsert.bulk_upsert`
+        :param model: sqlalchemy model class of the table to write to
+        :param rows: Dictionaries of column name to value. Every dictionary must have the same keys
+        """
+        bulk_upsert(self.engine, model, rows, super()._insert_or_update)
+
+    def _insert_or_update(self, insert_obj, identity_insert=False) -> None:
+        """
+        Inserts one object, or updates it if the primary key already exists. This overrides the DatabaseBaseClass
+        version, which tries the insert, catches the IntegrityError and then selects and updates, with the single upsert
+        statement from `atves.upsert.bulk_upsert`. Other databases still use the DatabaseBaseClass version.
+        :param insert_obj: sqlalchemy object to insert. Only the columns that were set on it are written
+        :param identity_insert: Only used by the DatabaseBaseClass version; bulk_upsert sets IDENTITY_INSERT itself
+        """
+        if self.engine.dialect.name not in UPSERT_DIALECTS:
+            super()._insert_or_update(insert_obj, identity_insert)
+            return
+
+        self._bulk_upsert(type(insert_obj), [{col.name: insert_obj.__dict__[col.key]
+                                              for col in insert_obj.__table__.columns
+                                              if col.key in insert_obj.__dict__}])
+
+    @staticmethod
+    def _get_date_ranges(dates: List[date], max_days: int = 90) -> List[Tuple[date, date]]:
+        """
+        Groups dates into ranges of consecutive days, so that reports can be pulled once per range instead of once per
+        day
+        :param dates: Dates to group, in any order
+        :param max_days: Maximum number of days in a range. Axsis has issues generating reports over 90 days.
+        :return: List of (start date, end date) tuples, both inclusive, with the most recent range first
+        """
+        ret: List[Tuple[date, date]] = []
+        for working_date in sorted(set(dates), reverse=True):
+            if ret and (ret[-1][0] - working_date).days == 1 and (ret[-1][1] - working_date).days < max_days:
+                ret[-1] = (working_date, ret[-1][1])
+            else:
+                ret.append((working_date, working_date))
+        return ret
 
     @retry(wait=wait_random_exponential(multiplier=1, max=60), stop=stop_after_attempt(7), reraise=True,
            retry=(retry_if_exception_type(JSONDecodeError)))
     def get_lat_long(self, address) -> Tuple[Optional[float], Optional[float]]:
         """
-        Get the latitude and longitude for an address if the accuracy score is high enough
+        Get the latitude and longitude for an address if the accuracy score is high enough, from the geocode cache when
+        it was looked up before
         :param address: Street address to search. The more complete the address, the better.
         """
-        logger.debug(f'Looking up {address}')
-        address = self._standardize_address(address)
+        logger.debug('Looking up {}', address)
+        address = standardize_address(address)
+        if address in _NOT_GEOCODABLE:
+            return None, None
+
+        if address in self._lat_long_cache:
+            return self._lat_long_cache[address]
+
+        with Session(bind=self.engine, future=True) as session:
+            cached = session.get(AtvesGeocodeCache, address)
+            if cached is not None:
+                self._lat_long_cache[address] = (float(cached.lat), float(cached.long))
+                return self._lat_long_cache[address]
+
         with warnings.catch_warnings():  # https://github.com/Esri/arcgis-python-api/issues/1090
             warnings.simplefilter("ignore")
-            geo_dict = geocode(f'{address}, Baltimore, MD')
+            geo_dict = _get_geocode()(f'{address}, Baltimore, MD')
         lat = None
         lng = None
         if geo_dict and geo_dict[0]['score'] > 80:
             lat = float(geo_dict[0]['location']['y'])
             lng = float(geo_dict[0]['location']['x'])
+            self._insert_or_update(AtvesGeocodeCache(address=address, lat=lat, long=lng))
+
+        # Failed lookups are only remembered for this session, so they are retried on the next run
+        self._lat_long_cache[address] = (lat, lng)
         return lat, lng
 
-    @staticmethod
-    def _standardize_address(street_address: str) -> str:
-        """The original dataset has addresses formatted in various ways. This attempts to standardize them a bit"""
-        street_address = street_address.upper()
-        street_address = street_address.replace(' BLK ', ' ')
-        street_address = street_address.replace(' BLOCK ', ' ')
-        street_address = street_address.replace('JONES FALLS', 'I-83')
-        street_address = street_address.replace('JONES FALLS EXPWY', 'I-83')
-        street_address = street_address.replace('JONES FALLS EXPRESSWAY', 'I-83')
-        street_address = street_address.replace('BLKLOCH', 'LOCH')
-        street_address = street_address.replace(' HW', ' HWY')
-        street_address = street_address.replace(' SB', '')
-        street_address = street_address.replace(' NB', '')
-        street_address = street_address.replace(' WB', '')
-        street_address = street_address.replace(' EB', '')
-        street_address = re.sub(r'^(\d*) N\.? (.*)', r'\1 NORTH \2', street_address)
-        street_address = re.sub(r'^(\d*) S\.? (.*)', r'\1 SOUTH \2', street_address)
-        street_address = re.sub(r'^(\d*) E\.? (.*)', r'\1 EAST \2', street_address)
-        street_address = re.sub(r'^(\d*) W\.? (.*)', r'\1 WEST \2', street_address)
-
-        return street_address
+    def _prefetch_lat_long(self, addresses: Iterable[str]) -> None:
+        """
+        Loads the geocode cache rows for a list of addresses into memory, so `get_lat_long` doesn't query the database
+        once per address. The location builders call this with every address they found before looking them up
+        :param addresses: Street addresses, as they would be passed to `get_lat_long`
+        """
+        to_load = list({address for address in map(standardize_address, addresses)
+                        if address not in _NOT_GEOCODABLE and address not in self._lat_long_cache})
+        with Session(bind=self.engine, future=True) as session:
+            for i in range(0, len(to_load), _GEOCODE_CACHE_BATCH_SIZE):
+                for cached in session.query(AtvesGeocodeCache) \
+                        .filter(AtvesGeocodeCache.address.in_(to_load[i:i + _GEOCODE_CACHE_BATCH_SIZE])):
+                    self._lat_long_cache[cached.address] = (float(cached.lat), float(cached.long))
 
 
 def setup_parser(help_str):
@@ -627,18 +887,21 @@ def setup_parser(help_str):
     parser = argparse.ArgumentParser(description=help_str)
     parser.add_argument('-v', '--verbose', action='store_true', help='Increased logging level')
     parser.add_argument('-vv', '--debug', action='store_true', help='Print debug statements')
+    parser.add_argument('--structured', action='store_true', help='Write the log file as JSON records')
     parser.add_argument('-c', '--conn_str', help='Database connection string',
                         default='mssql+pyodbc://balt-sql311-prd/DOT_DATA?driver=ODBC Driver 17 for SQL Server')
 
     return parser
 
 
-def setup_logging(debug: bool = False, verbose: bool = False) -> None:
+def setup_logging(debug: bool = False, verbose: bool = False, structured: bool = False) -> None:
     """
     Configures the logging level, and sets up file based logging
 
     :param debug: If true, the Debug logging level is used, and verbose is ignored
     :param verbose: If true and debug is false, then the info log level is used
+    :param structured: If true, the log file is written as JSON records instead of formatted lines. Serializing each
+    record is much more expensive than formatting it, so this is off by default
     """
     # Setup logging
     log_level = 'WARNING'
@@ -647,21 +910,26 @@ def setup_logging(debug: bool = False, verbose: bool = False) -> None:
     elif verbose:
         log_level = 'INFO'
 
+    # Drop loguru's default stderr handler, which logs everything at DEBUG. Otherwise every message is formatted
+    # regardless of log_level, and messages at or above log_level are printed twice
+    logger.remove()
     logger.add(sys.stdout, format="<green>{time}</green> <level>{message}</level>", colorize=True, backtrace=True,
                diagnose=True, level=log_level)
-    logger.add(os.path.join('logs', 'file-{time}.log'), format="{time:YYYY-MM-DD at HH:mm:ss} | {level} | {message}",
-               serialize=True, backtrace=True, diagnose=True, rotation='1 week', retention='3 months',
-               compression='zip', level=log_level)
+    # The file is written by a background thread through a 64KB buffer instead of line by line (see the atexit hook at
+    # the top of the module). Rotation is by size so a long backfill can't produce one huge file, and only the last 10
+    # rotated files are kept
+    _LOG_DIR.mkdir(exist_ok=True)
+    logger.add(_LOG_DIR / 'file-{time}.log', format="{time:YYYY-MM-DD at HH:mm:ss} | {level} | {message}",
+               serialize=structured, backtrace=True, diagnose=True, rotation='50 MB', retention=10,
+               compression='zip', level=log_level, buffering=65536, enqueue=True)
 
 
 def parse_args(_args):
     """Handles the argument parsing"""
     parser = setup_parser('Data importer from the ATVES data providers')
-    start_date = date.today() - timedelta(days=90)
-    end_date = date.today() - timedelta(days=1)
-    parser.add_argument('-s', '--startdate', type=date.fromisoformat, default=start_date,
+    parser.add_argument('-s', '--startdate', type=date.fromisoformat,
                         help='First date to process, inclusive (format YYYY-MM-DD). Defaults to 90 days ago')
-    parser.add_argument('-e', '--enddate', type=date.fromisoformat, default=end_date,
+    parser.add_argument('-e', '--enddate', type=date.fromisoformat,
                         help='Last date to process, inclusive (format YYYY-MM-DD). Defaults to yesterday.')
     parser.add_argument('-b', '--builddb', action='store_true',
                         help='Rebuilds (or updates) the camera location database')
@@ -669,12 +937,18 @@ def parse_args(_args):
                                                                    ' have no data in the database. This will force it '
                                                                    'to pull all data again.')
 
-    return parser.parse_args(_args)
+    parsed = parser.parse_args(_args)
+    # The defaults are filled in after parsing, so they are only computed when they are used
+    if parsed.startdate is None or parsed.enddate is None:
+        today = date.today()
+        parsed.startdate = parsed.startdate or today - timedelta(days=90)
+        parsed.enddate = parsed.enddate or today - timedelta(days=1)
+    return parsed
 
 
 if __name__ == '__main__':
     args = parse_args(sys.argv[1:])
-    setup_logging(args.debug, args.verbose)
+    setup_logging(args.debug, args.verbose, args.structured)
 
     ad = AtvesDatabase(conn_str=args.conn_str,
                        axsis_user=AXSIS_USERNAME,
@@ -684,9 +958,14 @@ if __name__ == '__main__':
                        report_user=REPORT_USERNAME,
                        report_pass=REPORT_PASSWORD)
 
-    ad.process_traffic_count_data(args.startdate, args.enddate, force=args.force)
-    ad.process_violations(args.startdate, args.enddate, force=args.force)
-    ad.process_financials(args.startdate, args.enddate, force=args.force)
-    ad.process_conduent_data_amber_time(args.startdate, args.enddate, force=args.force)
-    ad.process_officer_actions(args.startdate, args.enddate, force=args.force)
-    ad.build_location_db(args.builddb)
+    # The financial reports come from their own server, so they are pulled in the background. The Axsis and Conduent
+    # interfaces each keep one stateful web session, so the reports that use them run one at a time, with the Axsis and
+    # Conduent halves of the traffic count and violation reports running alongside each other
+    with ThreadPoolExecutor(max_workers=1) as financials_executor:
+        financials = financials_executor.submit(ad.process_financials, args.startdate, args.enddate, force=args.force)
+        ad.process_traffic_count_data(args.startdate, args.enddate, force=args.force)
+        ad.process_violations(args.startdate, args.enddate, force=args.force)
+        ad.process_conduent_data_amber_time(args.startdate, args.enddate, force=args.force)
+        ad.process_officer_actions(args.startdate, args.enddate, force=args.force)
+        ad.build_location_db(args.builddb)
+        financials.result()
@@ -102,6 +102,15 @@ class AtvesFinancial(Base):
     account_type = Column(String(length=50))
     agency_or_category = Column(String(length=50))
 
+
+class AtvesGeocodeCache(Base):
+    """Geocoder results by standardized address, so addresses are only sent to the geocoder once"""
+    __tablename__ = 'atves_geocode_cache'
+
+    address = Column(String(length=255), primary_key=True)
+    lat = Column(Numeric(precision=9, scale=6))
+    long = Column(Numeric(precision=9, scale=6))
+
 # Reports not yet being imported
 # get_approval_summary_by_queue
 # get_expired_by_location
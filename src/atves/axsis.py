@@ -56,6 +56,9 @@ class Axsis:
         self.password = password
         self.client_id = None
         self.client_code = None
+        # Report name to report id, from GetReports. The list doesn't change during a session, so it is only requested
+        # once instead of before every report
+        self._report_ids: Optional[Dict[str, int]] = None
         self._login()
 
     def _get_report(self, parameters: ReportsDetailType, report_type: Reports) -> requests.Response:
@@ -330,6 +333,9 @@ class Axsis:
         :param name: The name of the report
         :return: The report_id. If the `name` was not valid, then the return will be None
         """
+        if self._report_ids is not None:
+            return self._report_ids.get(name)
+
         headers = {
             'Accept': 'application/json, text/javascript, */*; q=0.01',
         }
@@ -346,11 +352,10 @@ class Axsis:
 
         resp_list = self._pythonify_literal(response.content.decode())
 
+        self._report_ids = {}
         for report in resp_list:
-            if report['ReportName'] == name:
-                return int(report['ReportId'])
-
-        return None
+            self._report_ids.setdefault(report['ReportName'], int(report['ReportId']))
+        return self._report_ids.get(name)
 
     @retry(wait=wait_random_exponential(multiplier=1, max=60), stop=stop_after_attempt(7), reraise=True,
            retry=retry_if_exception_type(requests.exceptions.ConnectionError))
@@ -14,6 +14,11 @@ from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_ra
 from atves.conduent_types import CameraType, ConduentResultsType, SessionStateType
 from atves.constants import ALLCAMS, REDLIGHT, OVERHEIGHT
 
+_SESSION_ID_RE = re.compile(r'ID=(\d*)')
+_CAMERA_RE = re.compile(r'Site Code:\s*(\d*)\s*(.*?)\s\s*Jurisdiction: (\S)\s*Date Created: (.*?)\s\s*Created By: '
+                        r'(.*?)\s\s*Effective Date: (.*?)\s\s*Speed Limit: (\d*)\s\s*Status: (\w*)')
+_REPORT_CSV_RE = re.compile(r'/media/.*\.csv')
+
 
 class Conduent:
     """Interface for Conduent that handles authentication and scraping"""
@@ -96,10 +101,9 @@ class Conduent:
         if len(id_tags) > 0:
             if len(id_tags) != 1:
                 logger.warning('Expected only one id tag, but found multiple: {}', id_tags)
-            pattern = re.compile(r'ID=(\d*)')
-            session_id = pattern.search(str(id_tags[0]))
+            session_id = _SESSION_ID_RE.search(str(id_tags[0]))
             if session_id is None:
-                raise AssertionError(f'Expected "ID=" in response. Got {pattern}')
+                raise AssertionError(f'Expected "ID=" in response. Got {id_tags[0]}')
 
             self.session_id = session_id.group(1)
 
@@ -117,12 +121,14 @@ class Conduent:
 
     @retry(wait=wait_random_exponential(multiplier=1, max=60), stop=stop_after_attempt(7), reraise=True,
            retry=retry_if_exception_type(requests.exceptions.ConnectionError))
-    def get_location_by_id(self, loc_id: int, cam_type: int) -> CameraType:
+    def get_location_by_id(self, loc_id: int, cam_type: int, setup_request: bool = True) -> CameraType:
         """
         Gets camera information by location id. The id is <ID> in
         https://cw3.cite-web.com/citeweb3/locationByID.asp?ID=<ID>
         :param loc_id: Camera ID to lookup
         :param cam_type: Type of camera data to pull (use the constants atves.REDLIGHT or atves.OVERHEIGHT
+        :param setup_request: If false, skips setting the session up for the camera type. Only use this when the
+        previous request on this session was a lookup for the same camera type, such as when looking up a range of ids
         :return: Dictionary of type `atves.conduent_types.CameraType` with camera data
         """
         ret: CameraType = {
@@ -136,16 +142,15 @@ class Conduent:
             'status': None,
             'cam_type': None}
 
-        if cam_type == REDLIGHT:
-            self._setup_report_request(REDLIGHT)
-        elif cam_type == OVERHEIGHT:
-            self._setup_report_request(OVERHEIGHT)
-        else:
-            raise AssertionError(f'Cam type {cam_type} is not valid'.format())
+        if cam_type not in [REDLIGHT, OVERHEIGHT]:
+            raise AssertionError(f'Cam type {cam_type} is not valid')
+
+        if setup_request:
+            self._setup_report_request(cam_type)
 
         resp = self.session.get(f'https://cw3.cite-web.com/citeweb3/locationByID.asp?ID={loc_id}')
         if resp.status_code == 500:
-            logger.error(f'Got HTTP response code {resp.status_code}')
+            logger.error('Got HTTP response code {}', resp.status_code)
             return ret
 
         soup = BeautifulSoup(resp.text, 'html.parser')
@@ -166,11 +171,9 @@ class Conduent:
         elif soup.select_one('p:-soup-contains("BaltimoreOH")'):
             cam_type_str = 'OH'
 
-        pattern = re.compile(r'Site Code:\s*(\d*)\s*(.*?)\s\s*Jurisdiction: (\S)\s*Date Created: (.*?)\s\s*Created By: '
-                             r'(.*?)\s\s*Effective Date: (.*?)\s\s*Speed Limit: (\d*)\s\s*Status: (\w*)')
-        results = pattern.search(text)
+        results = _CAMERA_RE.search(text)
         if results is None:
-            logger.error(f'Unable to find expected camera data in HTTP response: {text}')
+            logger.error('Unable to find expected camera data in HTTP response: {}', text)
             return ret
 
         return {'site_code': results.group(1),
@@ -548,16 +551,15 @@ class Conduent:
                                  data=payload,
                                  headers={'referer': 'https://cw3.cite-web.com/citeweb3/univReports.asp'})
         soup = BeautifulSoup(resp.text, 'html.parser')
-        pattern = re.compile(r'/media/.*\.csv')
         try:
             getreport = soup.find('a', {'name': 'aGetReport'})
             if not getreport:
-                logger.error(f'Unable to find "<a name="aGetReport..." tag in {soup}')
+                logger.error('Unable to find "<a name="aGetReport..." tag in {}', soup)
                 return None
 
-            onclick = pattern.search(getreport.get('onclick'))
+            onclick = _REPORT_CSV_RE.search(getreport.get('onclick'))
             if not onclick:
-                logger.error(f'Unable to find onclick element of <a name="aGetReport".. in \n{getreport}')
+                logger.error('Unable to find onclick element of <a name="aGetReport".. in \n{}', getreport)
                 return None
 
         except IndexError:
@@ -118,7 +118,7 @@ class CobReports:
         cleaned_response_url_base = response_url_base.replace(r'\u0026', '&')
         csv_data = self.browser.open(f'{self.baseurl}{cleaned_response_url_base}CSV').read()
 
-        logger.debug(f'Got {len(csv_data)} bytes of data')
+        logger.debug('Got {} bytes of data', len(csv_data))
 
         dtypes = {
             'JournalEntryNo': str,
@@ -211,7 +211,8 @@ class CobReports:
         self._log_controls()
 
     def _log_controls(self) -> None:
-        logger.debug('\n'.join(
+        # Lazy, so the controls are only walked when debug logging is on
+        logger.opt(lazy=True).debug('{}', lambda: '\n'.join(
             [f'{c.name}: {c.value} *{c.disabled}*'
              if c.disabled else f'{c.name}: {c.value}'
              for c in self.browser.form.controls]))
@@ -0,0 +1,191 @@
+"""Writes rows to the database in batches, inserting them or updating them if the primary key already exists"""
+from datetime import datetime
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Set
+
+import pandas as pd  # type: ignore
+from loguru import logger
+from sqlalchemy import Column, MetaData, Table, text  # type: ignore
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert  # type: ignore
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert  # type: ignore
+from sqlalchemy.types import Date, Integer, String  # type: ignore
+
+# Number of rows sent to the database per executemany call in bulk_upsert
+_UPSERT_BATCH_SIZE = 1000
+# Databases that bulk_upsert writes with a single upsert statement; others fall back to one row at a time
+UPSERT_DIALECTS = ('sqlite', 'postgresql', 'mssql')
+# Temporary table that bulk_upsert stages rows in on Sql Server, and the column that keeps the order they came in
+_MSSQL_STAGE_TABLE = '#atves_stage'
+_MSSQL_STAGE_ROW = 'atves_stage_row'
+
+
+def set_mssql_nocount(dbapi_connection, connection_record):  # pylint:disable=unused-argument
+    """
+    Stops Sql Server from sending a rows affected message for every statement, which for bulk_upsert's staging inserts
+    is one per row. This makes cursor.rowcount -1, which nothing here relies on
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute('SET NOCOUNT ON;')
+    cursor.close()
+
+
+def bulk_upsert(engine, model, rows: Iterable[Dict[str, Any]], insert_or_update: Callable[[Any], None]) -> None:
+    """
+    Inserts rows, or updates them if the primary key already exists, in batches within one transaction
+    :param engine: sqlalchemy engine of the database to write to
+    :param model: sqlalchemy model class of the table to write to
+    :param rows: Dictionaries of column name to value. Every dictionary must have the same keys. This can be a
+    generator; rows are only read one batch at a time
+    :param insert_or_update: Writes one model object, for databases that are not in UPSERT_DIALECTS
+    """
+    table = model.__table__
+    date_columns = {col.name for col in table.columns if isinstance(col.type, Date)}
+    rows = iter(rows)
+    if not (batch := _get_upsert_batch(rows, date_columns)):
+        return
+
+    primary_keys = [col.name for col in table.primary_key]
+    update_columns = [col for col in batch[0].keys() if col not in primary_keys]
+
+    dialect = engine.dialect.name
+    if dialect not in UPSERT_DIALECTS:
+        while batch:
+            for row in batch:
+                insert_or_update(model(**row))
+            batch = _get_upsert_batch(rows, date_columns)
+        return
+
+    with engine.begin() as connection:
+        if dialect == 'mssql':
+            row_count = _mssql_upsert(connection, table, batch, rows, date_columns)
+        else:
+            insert_stmt = sqlite_insert(table) if dialect == 'sqlite' else postgresql_insert(table)
+            stmt = insert_stmt.on_conflict_do_update(
+                index_elements=primary_keys,
+                set_={col: insert_stmt.excluded[col] for col in update_columns}) \
+                if update_columns else insert_stmt.on_conflict_do_nothing(index_elements=primary_keys)
+
+            row_count = 0
+            while batch:
+                connection.execute(stmt, batch)
+                row_count += len(batch)
+                batch = _get_upsert_batch(rows, date_columns)
+
+    logger.debug('Upserted {} rows into {}', row_count, table.name)
+
+
+def iter_records(data: pd.DataFrame) -> Iterator[Dict[str, Any]]:
+    """
+    Yields the rows of a dataframe as dictionaries of column name to value. This is the same as
+    data.to_dict('records'), without building the whole list at once
+    :param data: Dataframe to read
+    """
+    columns = list(data.columns)
+    for values in data.itertuples(index=False, name=None):
+        yield dict(zip(columns, values))
+
+
+def _get_upsert_batch(rows: Iterator[Dict[str, Any]], date_columns: Set[str]) -> List[Dict[str, Any]]:
+    """
+    Reads the next batch of rows for `bulk_upsert`, converted with `_to_db_value`
+    :param rows: Iterator of the rows passed to `bulk_upsert`
+    :param date_columns: Names of the Date columns of the table
+    :return: Up to _UPSERT_BATCH_SIZE rows; empty when there are no rows left
+    """
+    return [{col: _to_db_value(val, col in date_columns) for col, val in row.items()}
+            for row in islice(rows, _UPSERT_BATCH_SIZE)]
+
+
+def _mssql_upsert(connection, table, batch: List[Dict[str, Any]], rows: Iterator[Dict[str, Any]],
+                  date_columns: Set[str]) -> int:
+    """
+    The Sql Server part of `bulk_upsert`. The rows are inserted into a temporary staging table, which pyodbc's
+    fast_executemany sends a batch at a time, and then written to the table with one MERGE. A MERGE per row would
+    have the server run a separate statement for every row
+    :param connection: Connection with an open transaction. The staging table is created in it, so a rollback also
+    removes the staging table
+    :param table: sqlalchemy table to write to
+    :param batch: First batch of rows, from `_get_upsert_batch`
+    :param rows: Iterator of the rest of the rows passed to `bulk_upsert`
+    :param date_columns: Names of the Date columns of the table
+    :return: Number of rows written
+    """
+    columns = list(batch[0].keys())
+    # Temporary tables use the collation of tempdb, which can differ from the database's and then break the MERGE's
+    # string comparisons
+    stage = Table(_MSSQL_STAGE_TABLE, MetaData(),
+                  *[Column(col, String(length=table.c[col].type.length, collation='DATABASE_DEFAULT')
+                           if isinstance(table.c[col].type, String) else table.c[col].type)
+                    for col in columns],
+                  Column(_MSSQL_STAGE_ROW, Integer))
+    stage.create(connection)
+
+    row_count = 0
+    while batch:
+        for row in batch:
+            row[_MSSQL_STAGE_ROW] = row_count
+            row_count += 1
+        connection.execute(stage.insert(), batch)
+        batch = _get_upsert_batch(rows, date_columns)
+
+    preparer = connection.dialect.identifier_preparer
+    table_name = preparer.format_table(table)
+    # Sql Server makes a single integer primary key an identity column, and then needs IDENTITY_INSERT to write its
+    # value
+    pk_columns = list(table.primary_key.columns)
+    identity_insert = len(pk_columns) == 1 and isinstance(pk_columns[0].type, Integer) and \
+        pk_columns[0].autoincrement in (True, 'auto') and not pk_columns[0].foreign_keys
+    if identity_insert:
+        connection.execute(text(f'SET IDENTITY_INSERT {table_name} ON'))
+    try:
+        connection.execute(_get_mssql_merge(table, columns, preparer))
+    finally:
+        if identity_insert:
+            connection.execute(text(f'SET IDENTITY_INSERT {table_name} OFF'))
+
+    stage.drop(connection)
+    return row_count
+
+
+def _get_mssql_merge(table, columns: List[str], preparer):
+    """
+    Builds the Sql Server MERGE statement used by `_mssql_upsert` to write the staging table to the table. MERGE
+    fails if two source rows have the same primary key, so only the last row staged for each key is used, which is
+    what inserting or updating the rows one at a time would leave
+    :param table: sqlalchemy table to write to
+    :param columns: Names of the columns being written
+    :param preparer: Identifier preparer of the dialect, to quote the table and column names
+    """
+    primary_keys = [col.name for col in table.primary_key]
+    update_columns = [col for col in columns if col not in primary_keys]
+    quoted = {col: preparer.quote(col) for col in columns}
+    merge = f'MERGE {preparer.format_table(table)} WITH (HOLDLOCK) AS target ' \
+            f'USING (SELECT {", ".join(quoted.values())} ' \
+            f'FROM (SELECT *, ROW_NUMBER() OVER (PARTITION BY {", ".join(quoted[col] for col in primary_keys)} ' \
+            f'ORDER BY {_MSSQL_STAGE_ROW} DESC) AS row_rank FROM {_MSSQL_STAGE_TABLE}) AS ranked ' \
+            f'WHERE row_rank = 1) AS source ' \
+            f'ON {" AND ".join(f"target.{quoted[col]} = source.{quoted[col]}" for col in primary_keys)} '
+    if update_columns:
+        merge += f'WHEN MATCHED THEN UPDATE SET ' \
+                 f'{", ".join(f"target.{quoted[col]} = source.{quoted[col]}" for col in update_columns)} '
+    merge += f'WHEN NOT MATCHED THEN INSERT ({", ".join(quoted.values())}) ' \
+             f'VALUES ({", ".join(f"source.{quoted[col]}" for col in columns)});'
+    return text(merge)
+
+
+def _to_db_value(value, is_date: bool = False):
+    """
+    Converts a value from a pandas dataframe to something the database driver can take
+    :param value: Value to convert
+    :param is_date: If true, datetimes are converted to dates, for Date columns
+    """
+    if value is None or (pd.api.types.is_scalar(value) and pd.isna(value)):
+        return None
+    if isinstance(value, pd.Timestamp):
+        value = value.to_pydatetime()
+    elif hasattr(value, 'item'):
+        # numpy scalars
+        value = value.item()
+    if is_date and isinstance(value, datetime):
+        value = value.date()
+    return value
@@ -4,8 +4,8 @@ from sqlalchemy import create_engine  # type: ignore
 from sqlalchemy.orm import Session  # type: ignore
 
 import atves
-from atves.atves_schema import AtvesAmberTimeRejects, AtvesFinancial, AtvesTrafficCounts, AtvesViolations, \
-    AtvesViolationCategories
+from atves.atves_schema import AtvesAmberTimeRejects, AtvesFinancial, AtvesGeocodeCache, AtvesTrafficCounts, \
+    AtvesViolations, AtvesViolationCategories
 
 
 def pytest_addoption(parser):
@@ -114,6 +114,7 @@ def fixture_reset_database(conn_str):
         session.query(AtvesViolations).delete(synchronize_session=False)
         session.query(AtvesViolationCategories).delete(synchronize_session=False)
         session.query(AtvesFinancial).delete(synchronize_session=False)
+        session.query(AtvesGeocodeCache).delete(synchronize_session=False)
         session.commit()
 
 
@@ -0,0 +1,20 @@
+"""Tests atves.address"""
+from atves.address import standardize_address
+
+
+def test_standardize_address():
+    """Test standardize_address"""
+    assert standardize_address('100 E. Baltimore St') == '100 EAST BALTIMORE ST'
+    assert standardize_address('100 W Pratt St NB') == '100 WEST PRATT ST'
+    assert standardize_address('1200 N. Charles St') == '1200 NORTH CHARLES ST'
+    assert standardize_address('600 S Blkloch Raven Blvd') == '600 SOUTH LOCH RAVEN BLVD'
+    assert standardize_address('300 Block Edmondson Ave') == '300 EDMONDSON AVE'
+    assert standardize_address('S Hanover St & E Cross St') == 'S HANOVER ST & E CROSS ST'
+    assert standardize_address('100 EAST ST') == '100 EAST ST'
+    assert standardize_address('5 E') == '5 E'
+    assert standardize_address('4000 blk Pulaski Hwy WB') == '4000 PULASKI HWY'
+    assert standardize_address('4000 Pulaski Hw EB') == '4000 PULASKI HWY'
+    assert standardize_address('Jones Falls Expwy SB') == 'I-83'
+    assert standardize_address('Jones Falls Expressway & 28th St') == 'I-83 & 28TH ST'
+    assert standardize_address('100 Ebony Rd') == '100 EBONY RD'
+    assert standardize_address(' 100  E.  Baltimore St ') == '100 EAST BALTIMORE ST'
@@ -1,8 +1,10 @@
 """Test suite for atves_database.py"""
 # pylint:disable=protected-access,unused-argument
 import sys
+import threading
 import warnings
-from datetime import date
+from datetime import date, datetime, timedelta
+from functools import partial
 from pathlib import Path
 
 import pytest
@@ -11,9 +13,9 @@ from pandas import to_datetime  # type: ignore
 from sqlalchemy import create_engine, exc as sa_exc  # type: ignore
 from sqlalchemy.orm import Session  # type: ignore
 
-from atves.atves_database import parse_args
-from atves.atves_schema import AtvesAmberTimeRejects, AtvesCamLocations, AtvesFinancial, AtvesRejectReason, \
-    AtvesTrafficCounts, AtvesViolationCategories, AtvesViolations
+from atves.atves_database import AtvesDatabase, parse_args
+from atves.atves_schema import AtvesAmberTimeRejects, AtvesCamLocations, AtvesFinancial, AtvesGeocodeCache, \
+    AtvesRejectReason, AtvesTrafficCounts, AtvesViolationCategories, AtvesViolations
 from atves.constants import OVERHEIGHT, REDLIGHT, SPEED
 
 
@@ -218,8 +220,8 @@ def test_atvesdb_build_db_speed_cameras(atvesdb_fixture, atvesdb_fixture_no_cred
 
 
 @pytest.mark.conduent
-def test_get_cam_start_end(atvesdb_fixture, atvesdb_fixture_no_creds, conn_str, reset_database):
-    """Testing _get_cam_start_end"""
+def test_get_all_cam_start_end_violations(atvesdb_fixture, atvesdb_fixture_no_creds, conn_str, reset_database):
+    """Testing _get_all_cam_start_end with only violations"""
     engine = create_engine(conn_str, echo=True, future=True)
     with Session(bind=engine, future=True) as session:
         session.add_all([
@@ -246,11 +248,72 @@ def test_get_cam_start_end(atvesdb_fixture, atvesdb_fixture_no_creds, conn_str,
                 details='Citations Issued')
         ])
         session.commit()
-    start, end = atvesdb_fixture._get_cam_start_end('BAL100')
+    start, end = atvesdb_fixture._get_all_cam_start_end()['BAL100']
     assert start == date(2020, 1, 1)
     assert end == date(2020, 1, 3)
 
 
+def test_get_all_cam_start_end(atvesdb_fixture_no_creds, conn_str, reset_database):
+    """Testing _get_all_cam_start_end"""
+    engine = create_engine(conn_str, echo=True, future=True)
+    with Session(bind=engine, future=True) as session:
+        session.merge(AtvesCamLocations(location_code='TEST100', locationdescription='100 TEST ST', cam_type='SC'))
+        session.merge(AtvesCamLocations(location_code='TEST101', locationdescription='101 TEST ST', cam_type='SC'))
+        session.add_all([
+            AtvesViolationCategories(
+                violation_cat=5,
+                description=' '),
+            AtvesViolations(
+                date=to_datetime('2020-01-01 00:00:00.000'),
+                location_code='TEST100',
+                count=0,
+                violation_cat=5,
+                details='Citations Issued'),
+            AtvesViolations(
+                date=to_datetime('2020-01-03 00:00:00.000'),
+                location_code='TEST100',
+                count=0,
+                violation_cat=5,
+                details='Citations Issued'),
+            AtvesViolations(
+                date=to_datetime('2020-01-01 00:00:00.000'),
+                location_code='TEST101',
+                count=0,
+                violation_cat=5,
+                details='Citations Issued'),
+            AtvesTrafficCounts(
+                location_code='TEST101',
+                date=to_datetime('2020-02-01 00:00:00.000'),
+                count=500),
+            AtvesTrafficCounts(
+                location_code='TEST101',
+                date=to_datetime('2020-02-05 00:00:00.000'),
+                count=500)
+        ])
+        session.commit()
+
+    ret = atvesdb_fixture_no_creds._get_all_cam_start_end()
+    assert ret['TEST100'] == (date(2020, 1, 1), date(2020, 1, 3))
+    # traffic counts take precedence over violations
+    assert ret['TEST101'] == (date(2020, 2, 1), date(2020, 2, 5))
+    assert 'TEST102' not in ret
+
+
+def test_get_existing_cam_locations(atvesdb_fixture_no_creds):
+    """Testing _get_existing_cam_locations and _get_cam_location_values"""
+    def _cam_location(lat):
+        return AtvesCamLocations(location_code='TEST200', locationdescription='200 TEST ST', lat=lat, long=-76.61234,
+                                 cam_type='RL', effective_date=date(2020, 1, 1), last_record=date(2020, 2, 1),
+                                 days_active=31, speed_limit=0, status=True)
+
+    atvesdb_fixture_no_creds._insert_or_update(_cam_location(39.31234))
+
+    existing_cams = atvesdb_fixture_no_creds._get_existing_cam_locations()
+    # values that only differ past the precision of the database are not a change
+    assert existing_cams['TEST200'] == atvesdb_fixture_no_creds._get_cam_location_values(_cam_location(39.312341))
+    assert existing_cams['TEST200'] != atvesdb_fixture_no_creds._get_cam_location_values(_cam_location(39.3124))
+
+
 @pytest.mark.conduent
 def test_atvesdb_process_conduent_data_amber_time(atvesdb_fixture, atvesdb_fixture_no_creds, conn_str, reset_database):
     """Testing process_conduent_data_amber_time"""
@@ -405,12 +468,200 @@ def test_process_officer_actions(atvesdb_fixture, atvesdb_fixture_no_creds, conn
         assert ret.count() > 10
 
 
+def test_get_dates_to_process(atvesdb_fixture_no_creds, conn_str, reset_database):
+    """Test get_dates_to_process with both date and datetime columns"""
+    engine = create_engine(conn_str, echo=True, future=True)
+    with Session(bind=engine, future=True) as session:
+        session.merge(AtvesCamLocations(location_code='TEST100', locationdescription='100 TEST ST', cam_type='SC'))
+        session.add_all([
+            AtvesTrafficCounts(location_code='TEST100', date=date(2020, 1, 1), count=500),
+            AtvesTrafficCounts(location_code='TEST100', date=date(2020, 1, 3), count=500),
+            AtvesTrafficCounts(location_code='TEST100', date=date(2020, 1, 10), count=500),
+            AtvesAmberTimeRejects(location_code='TEST100', deployment_no=1, violation_date=datetime(2020, 1, 2, 23, 59),
+                                  amber_time=3.5, amber_reject_code='Test', event_number=1),
+            AtvesAmberTimeRejects(location_code='TEST100', deployment_no=1, violation_date=datetime(2020, 1, 4, 0, 0),
+                                  amber_time=3.5, amber_reject_code='Test', event_number=2)
+        ])
+        session.commit()
+
+    start_date = date(2020, 1, 1)
+    end_date = date(2020, 1, 4)
+    assert atvesdb_fixture_no_creds.get_dates_to_process(start_date, end_date, AtvesTrafficCounts.date) == \
+        [date(2020, 1, 4), date(2020, 1, 2)]
+    assert atvesdb_fixture_no_creds.get_dates_to_process(start_date, end_date,
+                                                         AtvesAmberTimeRejects.violation_date) == \
+        [date(2020, 1, 3), date(2020, 1, 1)]
+    assert atvesdb_fixture_no_creds.get_dates_to_process(start_date, end_date, AtvesTrafficCounts.date, True) == \
+        [date(2020, 1, 4), date(2020, 1, 3), date(2020, 1, 2), date(2020, 1, 1)]
+
+
+def test_bulk_upsert(atvesdb_fixture_no_creds, conn_str, reset_database):
+    """Test _bulk_upsert inserts new rows and updates existing ones"""
+    engine = create_engine(conn_str, echo=True, future=True)
+    with Session(bind=engine, future=True) as session:
+        session.merge(AtvesCamLocations(location_code='TEST100', locationdescription='100 TEST ST', cam_type='SC'))
+        session.commit()
+
+    atvesdb_fixture_no_creds._bulk_upsert(AtvesTrafficCounts, [
+        {'location_code': 'TEST100', 'date': to_datetime('2020-01-01'), 'count': 100},
+        {'location_code': 'TEST100', 'date': to_datetime('2020-01-02'), 'count': 200}])
+    atvesdb_fixture_no_creds._bulk_upsert(AtvesTrafficCounts, [
+        {'location_code': 'TEST100', 'date': to_datetime('2020-01-02'), 'count': 250},
+        {'location_code': 'TEST100', 'date': to_datetime('2020-01-03'), 'count': float('nan')}])
+    atvesdb_fixture_no_creds._bulk_upsert(AtvesTrafficCounts, [])
+
+    with Session(bind=engine, future=True) as session:
+        assert {(i.date, i.count) for i in session.query(AtvesTrafficCounts)} == \
+            {(date(2020, 1, 1), 100), (date(2020, 1, 2), 250), (date(2020, 1, 3), None)}
+
+    # Generators are read in batches
+    atvesdb_fixture_no_creds._bulk_upsert(AtvesTrafficCounts, (
+        {'location_code': 'TEST100', 'date': date(2010, 1, 1) + timedelta(days=i), 'count': i} for i in range(2500)))
+    with Session(bind=engine, future=True) as session:
+        assert session.query(AtvesTrafficCounts).filter(AtvesTrafficCounts.date < date(2020, 1, 1)).count() == 2500
+
+
+def test_insert_or_update(atvesdb_fixture_no_creds, conn_str, reset_database):
+    """Test _insert_or_update inserts a new object and updates it when the primary key already exists"""
+    atvesdb_fixture_no_creds._insert_or_update(
+        AtvesCamLocations(location_code='TEST200', locationdescription='200 TEST ST', cam_type='SC'))
+    atvesdb_fixture_no_creds._insert_or_update(
+        AtvesCamLocations(location_code='TEST200', locationdescription='200 TEST AVE', cam_type='SC'))
+
+    engine = create_engine(conn_str, echo=True, future=True)
+    with Session(bind=engine, future=True) as session:
+        assert [(i.locationdescription, i.cam_type) for i in
+                session.query(AtvesCamLocations).filter(AtvesCamLocations.location_code == 'TEST200')] == \
+            [('200 TEST AVE', 'SC')]
+
+
+def test_echo(conn_str, monkeypatch):
+    """Test statement logging is off unless it is asked for"""
+    monkeypatch.delenv('ATVES_SQL_ECHO', raising=False)
+    assert not AtvesDatabase(conn_str, None, None, None, None, None, None).engine.echo
+    assert AtvesDatabase(conn_str, None, None, None, None, None, None, echo=True).engine.echo
+
+    monkeypatch.setenv('ATVES_SQL_ECHO', '1')
+    assert AtvesDatabase(conn_str, None, None, None, None, None, None).engine.echo
+    assert not AtvesDatabase(conn_str, None, None, None, None, None, None, echo=False).engine.echo
+
+
+def test_sqlite_sync(monkeypatch):
+    """Test an invalid ATVES_SQLITE_SYNC is rejected when the database is created"""
+    monkeypatch.setenv('ATVES_SQLITE_SYNC', 'SOMETIMES')
+    with pytest.raises(ValueError, match='ATVES_SQLITE_SYNC'):
+        AtvesDatabase('sqlite:///:memory:', None, None, None, None, None, None)
+
+
+def test_process_axsis_and_conduent(tmp_path):
+    """Test both halves of a report can write to the same SQLite file at once"""
+    atvesdb = AtvesDatabase(f'sqlite:///{tmp_path / "concurrent.db"}', None, None, None, None, None, None)
+    with atvesdb.engine.connect() as connection:
+        assert connection.exec_driver_sql('PRAGMA busy_timeout').scalar() > 5000
+
+    def _write(prefix, _date_ranges):
+        for i in range(10):
+            atvesdb._bulk_upsert(AtvesGeocodeCache, ({'address': f'{prefix} {i} {j}', 'lat': 39.0, 'long': -76.0}
+                                                     for j in range(2000)))
+
+    AtvesDatabase._process_axsis_and_conduent(partial(_write, 'AXSIS'), partial(_write, 'CONDUENT'), [])
+    with Session(bind=atvesdb.engine, future=True) as session:
+        assert session.query(AtvesGeocodeCache).count() == 40000
+
+
+def test_fetch_ahead():
+    """Test _fetch_ahead returns the reports in order, and downloads the next one while the current one is used"""
+    date_ranges = [(date(2021, 7, 5), date(2021, 7, 7)), (date(2021, 7, 1), date(2021, 7, 3))]
+    next_fetched = threading.Event()
+
+    def _fetch(start_date, end_date):
+        if start_date == date(2021, 7, 1):
+            next_fetched.set()
+        return start_date, end_date
+
+    reports = AtvesDatabase._fetch_ahead(_fetch, date_ranges)
+    assert next(reports) == date_ranges[0]
+    assert next_fetched.wait(timeout=10)
+    assert list(reports) == date_ranges[1:]
+
+    assert not list(AtvesDatabase._fetch_ahead(_fetch, []))
+
+
+def test_get_date_ranges():
+    """Test _get_date_ranges"""
+    assert not AtvesDatabase._get_date_ranges([])
+    assert AtvesDatabase._get_date_ranges([date(2021, 7, 1)]) == [(date(2021, 7, 1), date(2021, 7, 1))]
+
+    dates = [date(2021, 7, 1), date(2021, 7, 3), date(2021, 7, 2), date(2021, 7, 5), date(2021, 7, 7),
+             date(2021, 7, 6)]
+    assert AtvesDatabase._get_date_ranges(dates) == [(date(2021, 7, 5), date(2021, 7, 7)),
+                                                     (date(2021, 7, 1), date(2021, 7, 3))]
+
+    dates = [date(2021, 1, 1) + timedelta(days=i) for i in range(200)]
+    assert AtvesDatabase._get_date_ranges(dates) == [(date(2021, 4, 21), date(2021, 7, 19)),
+                                                     (date(2021, 1, 21), date(2021, 4, 20)),
+                                                     (date(2021, 1, 1), date(2021, 1, 20))]
+
+
 def test_get_lat_long(atvesdb_fixture):
     """Test get_lat_long"""
     lat, lng = atvesdb_fixture.get_lat_long('4000 blk Pulaski Hwy WB')
     assert lat and lng
 
 
+def test_get_lat_long_cached(atvesdb_fixture_no_creds, conn_str, reset_database):
+    """Test get_lat_long answers from the geocode cache, which is keyed by the standardized address"""
+    atvesdb_fixture_no_creds._lat_long_cache.clear()
+    engine = create_engine(conn_str, echo=True, future=True)
+    with Session(bind=engine, future=True) as session:
+        session.merge(AtvesGeocodeCache(address='100 EAST BALTIMORE ST', lat=39.289444, long=-76.611667))
+        session.commit()
+
+    lat, lng = atvesdb_fixture_no_creds.get_lat_long('100 E. Baltimore St')
+    assert lat == pytest.approx(39.289444)
+    assert lng == pytest.approx(-76.611667)
+
+    # Later lookups in the same session are answered from memory
+    with Session(bind=engine, future=True) as session:
+        session.query(AtvesGeocodeCache).delete()
+        session.commit()
+    assert atvesdb_fixture_no_creds.get_lat_long('100 EAST BALTIMORE ST') == (lat, lng)
+
+
+def test_prefetch_lat_long(atvesdb_fixture_no_creds, conn_str, reset_database):
+    """Test _prefetch_lat_long loads the cached addresses into memory with one query"""
+    atvesdb_fixture_no_creds._lat_long_cache.clear()
+    engine = create_engine(conn_str, echo=True, future=True)
+    with Session(bind=engine, future=True) as session:
+        session.merge(AtvesGeocodeCache(address='200 WEST PRATT ST', lat=39.286667, long=-76.619444))
+        session.commit()
+
+    atvesdb_fixture_no_creds._prefetch_lat_long(['200 W. Pratt St', '200 W Pratt St', 'Unknown', '300 NOT CACHED ST'])
+    assert atvesdb_fixture_no_creds._lat_long_cache['200 WEST PRATT ST'] == \
+        (pytest.approx(39.286667), pytest.approx(-76.619444))
+    assert '300 NOT CACHED ST' not in atvesdb_fixture_no_creds._lat_long_cache
+    assert 'UNKNOWN' not in atvesdb_fixture_no_creds._lat_long_cache
+
+
+def test_get_lat_long_not_geocodable(atvesdb_fixture_no_creds):
+    """Test get_lat_long skips the geocoder for blank and placeholder addresses"""
+    for address in ['', '  ', 'All Locations', 'Unknown']:
+        assert atvesdb_fixture_no_creds.get_lat_long(address) == (None, None)
+
+
+def test_parse_effective_date():
+    """Test _parse_effective_date"""
+    assert AtvesDatabase._parse_effective_date('Jan 05, 2021') == date(2021, 1, 5)
+    assert AtvesDatabase._parse_effective_date('Dec 31, 1999') == date(1999, 12, 31)
+    assert AtvesDatabase._parse_effective_date('Sep 1, 2015') == date(2015, 9, 1)
+    assert AtvesDatabase._parse_effective_date('JAN 05, 2021') == date(2021, 1, 5)
+    assert AtvesDatabase._parse_effective_date('feb 28, 2021') == date(2021, 2, 28)
+
+    for effective_date in ['', 'Jan 2021', 'Foo 05, 2021', 'Jan 32, 2021', '2021-01-05']:
+        with pytest.raises(ValueError):
+            AtvesDatabase._parse_effective_date(effective_date)
+
+
 def setup_logging(debug=False, info=False, path: Path = None):
     """
     Configures the logging level, and sets up file based logging. By default, the following logging levels are enabled:
@@ -452,8 +703,13 @@ def test_parse_args():
     args = parse_args(['-v', '-c', conn_str, '-s', start_date_str, '-e', end_date_str, '-b', '-f'])
     assert args.verbose
     assert not args.debug
+    assert not args.structured
     assert args.conn_str == conn_str
     assert args.startdate == start_date
     assert args.enddate == end_date
     assert args.builddb
     assert args.force
+
+    args = parse_args([])
+    assert args.startdate == date.today() - timedelta(days=90)
+    assert args.enddate == date.today() - timedelta(days=1)
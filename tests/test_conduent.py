@@ -36,6 +36,9 @@ def test_conduent_get_location_by_id(conduent_fixture):
         assert str(ret['speed_limit']).isnumeric()
         assert ret['status'] == 'Active'
 
+        # The session is already set up for this camera type
+        assert conduent_fixture.get_location_by_id(1, cam_type, setup_request=False) == ret
+
 
 @pytest.mark.conduent
 def test_conduent_get_location_by_id_invalid(conduent_fixture):